@@ -2,3 +2,9 @@
 # Basic personal tools for seismic data processing
 __version__ = "1.0"
 __author__ = "Robert G Green"
+
+# Submodules are imported on first attribute access, so that
+# "import greentools" does not pull in numpy, obspy or matplotlib
+from greentools._lazy import lazy_submodules
+__getattr__=lazy_submodules(__name__,('core','dispersion','instrumentation',
+                                      'plotting','response_removal'))
@@ -0,0 +1,44 @@
+"""
+Lazy loading of package submodules on first attribute access
+"""
+import sys
+import types
+import importlib
+
+
+def lazy_submodules(name,submodules):
+    """ Make the submodules of a package importable on first access
+
+    Returns a module level __getattr__ for the package (python 3.7+).
+    On older pythons, which ignore module __getattr__, the package in
+    sys.modules is replaced by a module subclass using the same hook.
+    Call this at the end of the package __init__.py.
+
+    :type name: string
+    :param name: Name of the package, i.e. __name__
+    :type submodules: tuple of strings
+    :param submodules: Names of the submodules to load lazily
+    """
+    def __getattr__(attr):
+        if attr in submodules :
+            return importlib.import_module(name+"."+attr)
+        raise AttributeError("module '%s' has no attribute '%s'" % (name,attr))
+
+    if sys.version_info<(3,7) :
+        module=sys.modules[name]
+        lazy=_LazyModule(name)
+        lazy.__dict__.update(module.__dict__)
+        lazy._lazy_getattr=__getattr__
+        # Keep the original alive, python 2 clears the globals of
+        # collected modules which its functions still refer to
+        lazy._original_module=module
+        sys.modules[name]=lazy
+    return __getattr__
+
+
+class _LazyModule(types.ModuleType):
+    def __getattr__(self,attr):
+        # Only called when normal lookup fails
+        if attr=='_lazy_getattr' :
+            raise AttributeError(attr)
+        return self._lazy_getattr(attr)
@@ -2,9 +2,11 @@
 Module containing core convenience functions for working with seismic data in obspy
 """
 
-import os,sys
-import numpy as np
-import cPickle as pickle
+import os,sys,errno
+from greentools import instrumentation
+
+# numpy and cPickle are imported inside the functions that use them to
+# keep the import of this module cheap for short-lived worker processes
 
 def create_path(directory):
     """Create a given path with all parent directories
@@ -23,7 +25,7 @@ def create_path(directory):
         try :
             os.makedirs(directory)
         except OSError as e :
-            if e[0]==17 :
+            if e.errno==errno.EEXIST :
                 pass
             else :
                 raise OSError(e)
@@ -31,48 +33,68 @@ def create_path(directory):
         assert os.path.isdir(directory), "%s exists but is not a directory" % subpath
     return 0
 
+def _pickle():
+    """ cPickle on python 2, pickle (which is C accelerated) on python 3 """
+    try :
+        import cPickle as pickle
+    except ImportError :
+        import pickle
+    return pickle
+
+@instrumentation.timed()
 def save_to_pickle(fname,obj):
     """
     Save python object as a pickle
     file using cPickle.
     """
+    pickle=_pickle()
     pickle_out = open(fname,"wb")
     pickle.dump(obj, pickle_out)
     pickle_out.close()
+    instrumentation.add_file(fname,written=True)
     return
 
+@instrumentation.timed()
 def load_from_pickle(fname):
     """
     Load a python object from a pickle
     file using cPickle
     """
+    pickle=_pickle()
     pickle_in = open(fname,"rb")
     obj = pickle.load(pickle_in)
+    instrumentation.add_file(fname)
     return obj
 
 
+@instrumentation.timed()
 def write_st_to_mseed(st,fpath) :
     '''
     Write stream object to a miniseed file
     If dtype is float the encoding is set to float32 to save on disk space
     SAC files also save 32 bit floats.
     '''
+    import numpy as np
     for tr in st:
         if tr.data.dtype=="float64" :
             tr.data = tr.data.astype(np.float32)
             tr.stats.mseed.encoding="FLOAT32"
     create_path(os.path.dirname(fpath))
     st.write(fpath,format="MSEED")
+    instrumentation.add_file(fpath,written=True,traces=len(st))
     return 0
 
 
+@instrumentation.timed()
 def downsample(st,goal_sampling_rate) :
     '''
     Downsample stream to goal_sampling_rate
     (1) Apply antialias filter of 0.4 * goal_sampling_rate
     (2) Decimate, or else resample with lanczos method
     '''
+    import numpy as np
     goal_sampling_rate=float(goal_sampling_rate)
+    instrumentation.add(traces=len(st))
     for tr in st :
         tr.filter("lowpass", freq=float(0.4*goal_sampling_rate), zerophase=True)
         dec_factor=tr.stats.sampling_rate/goal_sampling_rate
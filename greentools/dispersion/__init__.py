@@ -0,0 +1,3 @@
+# Submodules are imported on first attribute access
+from greentools._lazy import lazy_submodules
+__getattr__=lazy_submodules(__name__,('aftan','coverage','misc','xdc'))
@@ -1,11 +1,11 @@
 """
 Module containing functions used around dispersion calculations
 """
-from glob import glob
 import os,sys
 import numpy as np
-from obspy.core import read
+from greentools import instrumentation
 
+@instrumentation.timed()
 def read_disp_file(infile,disptype=None) :
     """ Reads the text file format containing dispersion
     results from aFTAN. 
@@ -27,6 +27,7 @@ def read_disp_file(infile,disptype=None) :
 
     # Read the AFTAN file and create lists
     lines=open(infile,'r').readlines()
+    instrumentation.add_file(infile,picks=len(lines))
     periods,dispvels=[],[]
     for line in lines :
         line=line.rstrip().split()
@@ -42,6 +43,7 @@ def read_disp_file(infile,disptype=None) :
     periods,dispvels=np.array(periods),np.array(dispvels)
     return periods,dispvels
 
+@instrumentation.timed()
 def read_amp_file(infile,disptype,normalise=True):
     """ Reads the text file format containing the ftan 
     dispersion image from aFTAN
@@ -57,6 +59,7 @@ def read_amp_file(infile,disptype,normalise=True):
     except :
         periods_clean,dispvels_clean=None,None
     amplines=open(infile).readlines()
+    instrumentation.add_file(infile)
     nrow,ncol,dt,dist = amplines[0].strip().split()
     if ncol == "-15432" :
         print("No AMP map "+infile.split('/')[-1])
@@ -84,16 +87,18 @@ def read_amp_file(infile,disptype,normalise=True):
     return periods,vels,ampn,dispvels,periods_clean,dispvels_clean
 
 
+@instrumentation.timed()
 def read_aftan_resultfile(infile,disptype="centre_period") :
 
     if disptype=='obs_period' or disptype=='centre_period' :
         pass
     else :
-        print "Input for function getdispersion must be <infile> <disptype>"
-        print "<disptype> : centre_period or obs_period"
+        print("Input for function getdispersion must be <infile> <disptype>")
+        print("<disptype> : centre_period or obs_period")
 
     # Read the AFTAN file and create lists
     lines=open(infile,'r').readlines()
+    instrumentation.add_file(infile,picks=len(lines))
     periods,dispvels=[],[]
     for line in lines :
         line=line.rstrip().split()
@@ -0,0 +1,266 @@
+"""
+Module containing functions for ray coverage and path density of
+tomography inputs
+
+All great-circle paths are cut where they cross the meridian and parallel
+edges of a lon/lat grid, with the crossings solved in closed form for
+batches of rays with numpy. Cell counts and path lengths are exact for a
+spherical Earth, however short the crossing of a cell. Rays are
+undirected, so azimuths are folded into [0,180) degrees.
+
+The run time grows with the number of cell edges crossed, i.e. with path
+length over cell size, and not with the extent of the grid: a million
+rays up to 14 degrees long take a few seconds on a 1 degree grid, global
+or not, and about half a minute on a 0.1 degree grid.
+"""
+import numpy as np
+from greentools import instrumentation
+
+EARTH_RADIUS_KM=6371.0
+
+# Number of crossings handled per batch, limits the memory use
+_BATCH_POINTS=2000000
+
+# Angles in radians below which crossings are treated as coincident
+_EPS=1e-12
+
+
+def _unit_vectors(lat,lon):
+    lat,lon=np.radians(lat),np.radians(lon)
+    return np.array([np.cos(lat)*np.cos(lon),np.cos(lat)*np.sin(lon),np.sin(lat)])
+
+def _bin_index(x,edges):
+    """ Index of the bin containing x, outside values give -1 or len(edges)-1 """
+    step=np.diff(edges)
+    if np.allclose(step,step[0]) :
+        # Regular grid, much faster than searchsorted
+        return np.floor((x-edges[0])/step[0]).astype(int)
+    return np.searchsorted(edges,x,side='right')-1
+
+def _ragged(start,count):
+    """ Ray number and start..start+count-1 for each ray, flattened """
+    ray=np.repeat(np.arange(len(count)),count)
+    offset=np.cumsum(count)-count
+    return ray,np.arange(len(ray))-offset[ray]+start[ray]
+
+
+@instrumentation.timed()
+def ray_coverage(lat1,lon1,lat2,lon2,lon_edges,lat_edges,naz=18):
+    """ Rasterise great-circle paths onto a lon/lat grid
+
+    :type lat1,lon1,lat2,lon2: :class:`~numpy.ndarray`
+    :param lat1,lon1,lat2,lon2: Coordinates of the path end points in degrees
+    :type lon_edges,lat_edges: :class:`~numpy.ndarray`
+    :param lon_edges,lat_edges: Increasing cell edges of the grid in degrees
+    :type naz: int
+    :param naz: Number of azimuth bins between 0 and 180 degrees
+    :rtype: dictionary
+    :return: 'counts' number of rays crossing each cell, shape (nlat,nlon)
+             'length' total path length in km in each cell, shape (nlat,nlon)
+             'azimuth' number of rays crossing each cell per azimuth bin,
+                       shape (nlat,nlon,naz), azimuth taken where the ray
+                       enters the cell
+             'azimuth_edges' edges of the azimuth bins in degrees
+             Rays with coincident or antipodal end points have no unique
+             path and are not included.
+    """
+    lat1,lon1=np.atleast_1d(lat1).astype(float),np.atleast_1d(lon1).astype(float)
+    lat2,lon2=np.atleast_1d(lat2).astype(float),np.atleast_1d(lon2).astype(float)
+    lon_edges,lat_edges=np.asarray(lon_edges,dtype=float),np.asarray(lat_edges,dtype=float)
+    nlon,nlat=len(lon_edges)-1,len(lat_edges)-1
+    ncell=nlon*nlat
+    instrumentation.add(rays=len(lat1))
+
+    counts=np.zeros(ncell)
+    length=np.zeros(ncell)
+    azimuth=np.zeros(ncell*naz)
+
+    # Angular separation of the end points and the unit tangent at a
+    # towards b, the path is p=cos(theta)*a+sin(theta)*u for theta in
+    # [0,omega]. Coincident or antipodal end points give no unique path,
+    # those rays are left out.
+    a,b=_unit_vectors(lat1,lon1),_unit_vectors(lat2,lon2)
+    omega=np.arccos(np.clip(np.sum(a*b,axis=0),-1.,1.))
+    u=b-np.cos(omega)*a
+    norm=np.sqrt(np.sum(u*u,axis=0))
+    keep=norm>_EPS
+    a,u,omega=a[:,keep],u[:,keep]/norm[keep],omega[keep]
+    b=b[:,keep]
+
+    # Longitude changes monotonically along a great circle, in the sense
+    # of the z component of a x u, and by less than 180 degrees along a
+    # path shorter than half the circle. Meridional paths only change
+    # longitude at a pole, which is a turning point below.
+    lz=a[0]*u[1]-a[1]*u[0]
+    lon_a=np.degrees(np.arctan2(a[1],a[0]))
+    dlon=np.mod(np.degrees(np.arctan2(b[1],b[0]))-lon_a+180.,360.)-180.
+    dlon[(lz>0)&(dlon<-90.)]+=360.
+    dlon[(lz<0)&(dlon>90.)]-=360.
+    # Edges repeated a turn either side so any longitude convention matches
+    ext_edges=np.concatenate([lon_edges-360.,lon_edges,lon_edges+360.])
+    lo,hi=np.minimum(lon_a,lon_a+dlon),np.maximum(lon_a,lon_a+dlon)
+    imer=np.searchsorted(ext_edges,lo-1e-6,side='left')
+    nmer=np.searchsorted(ext_edges,hi+1e-6,side='right')-imer
+    nmer[np.abs(lz)<_EPS]=0
+
+    # Height along the path is z=r*cos(theta-psi), the range of z covered
+    # includes the turning points inside the path
+    r=np.hypot(a[2],u[2])
+    psi=np.arctan2(u[2],a[2])
+    zmin,zmax=np.minimum(a[2],b[2]),np.maximum(a[2],b[2])
+    zmax[np.mod(psi,2*np.pi)<=omega]=r[np.mod(psi,2*np.pi)<=omega]
+    zmin[np.mod(psi+np.pi,2*np.pi)<=omega]=-r[np.mod(psi+np.pi,2*np.pi)<=omega]
+    sin_edges=np.sin(np.radians(lat_edges))
+    ipar=np.searchsorted(sin_edges,zmin-1e-12,side='left')
+    npar=np.searchsorted(sin_edges,zmax+1e-12,side='right')-ipar
+    # Paths along the equator never change latitude
+    npar[r<_EPS]=0
+
+    # Each ray has its end points, two turning points, one crossing per
+    # meridian and up to two per parallel. Batch rays by that total.
+    npoints=nmer+2*npar+4
+    cum=np.cumsum(npoints)
+    start=0
+    while start<len(omega) :
+        base=cum[start-1] if start>0 else 0
+        stop=max(np.searchsorted(cum,base+_BATCH_POINTS,side='right'),start+1)
+        idx=np.arange(start,stop)
+        _rasterise_batch(a[:,idx],u[:,idx],omega[idx],r[idx],psi[idx],
+                         imer[idx],nmer[idx],ipar[idx],npar[idx],ext_edges,sin_edges,
+                         lon_edges,lat_edges,naz,counts,length,azimuth)
+        start=stop
+
+    return {'counts':counts.reshape(nlat,nlon),
+            'length':length.reshape(nlat,nlon),
+            'azimuth':azimuth.reshape(nlat,nlon,naz),
+            'azimuth_edges':np.linspace(0.,180.,naz+1)}
+
+
+def _rasterise_batch(a,u,omega,r,psi,imer,nmer,ipar,npar,ext_edges,sin_edges,
+                     lon_edges,lat_edges,naz,counts,length,azimuth):
+    """ Add the paths of a batch of rays to the grid arrays in place """
+    nlon,nlat=len(lon_edges)-1,len(lat_edges)-1
+    nray=len(omega)
+
+    # Crossings of the plane through each candidate meridian, the root in
+    # [0,pi) is the only one that can lie on the path
+    mray,iedge=_ragged(imer,nmer)
+    lam=np.radians(ext_edges[iedge])
+    an=-a[0][mray]*np.sin(lam)+a[1][mray]*np.cos(lam)
+    un=-u[0][mray]*np.sin(lam)+u[1][mray]*np.cos(lam)
+    tmer=np.mod(np.arctan2(-an,un),np.pi)
+
+    # Crossings of each candidate parallel, r*cos(theta-psi)=sin(lat)
+    pray,iedge=_ragged(ipar,npar)
+    half=np.arccos(np.clip(sin_edges[iedge]/r[pray],-1.,1.))
+    tpar=np.concatenate([np.mod(psi[pray]-half,2*np.pi),np.mod(psi[pray]+half,2*np.pi)])
+
+    # End points and turning points in latitude, the latter split paths
+    # through a pole where the longitude jumps by 180 degrees
+    rays=np.arange(nray)
+    tend=np.concatenate([np.zeros(nray),omega,np.mod(psi,2*np.pi),np.mod(psi+np.pi,2*np.pi)])
+
+    theta=np.concatenate([tmer,tpar,tend])
+    ray=np.concatenate([mray,pray,pray,rays,rays,rays,rays])
+    on_path=theta<=omega[ray]
+    theta,ray=theta[on_path],ray[on_path]
+    # Sort the crossings along each ray on an integer key, much faster than
+    # lexsort. Theta<4 is quantised to 2**-40 radians, below _EPS, and a
+    # batch has under 2**20 rays as each ray has at least four points.
+    key=(ray.astype(np.int64)<<42)+(theta*2.**40).astype(np.int64)
+    order=np.argsort(key)
+    theta,ray=theta[order],ray[order]
+
+    # Pieces of path between consecutive crossings each lie in one cell,
+    # found from their middle point
+    piece=(ray[1:]==ray[:-1])&(theta[1:]-theta[:-1]>_EPS)
+    t0,t1,ray=theta[:-1][piece],theta[1:][piece],ray[:-1][piece]
+    tm=0.5*(t0+t1)
+    cos_t,sin_t=np.cos(tm),np.sin(tm)
+    px=cos_t*a[0][ray]+sin_t*u[0][ray]
+    py=cos_t*a[1][ray]+sin_t*u[1][ray]
+    pz=cos_t*a[2][ray]+sin_t*u[2][ray]
+    lon=np.degrees(np.arctan2(py,px))
+    # Match the longitude convention of the grid, e.g. 0-360
+    lon[lon<lon_edges[0]]+=360.
+    ilon=_bin_index(lon,lon_edges)
+    ilat=_bin_index(np.degrees(np.arcsin(np.clip(pz,-1.,1.))),lat_edges)
+    inside=(ilon>=0)&(ilon<nlon)&(ilat>=0)&(ilat<nlat)
+    cell=np.where(inside,ilat*nlon+ilon,-1)
+
+    length+=np.bincount(cell[inside],weights=(t1-t0)[inside]*EARTH_RADIUS_KM,
+                        minlength=len(length))
+
+    # Pieces where a ray enters a cell. A ray can leave and re-enter
+    # a cell through the same parallel, so only its first entry counts.
+    entry=np.ones(len(cell),dtype=bool)
+    entry[1:]=(cell[1:]!=cell[:-1])|(ray[1:]!=ray[:-1])
+    entry&=inside
+    first=np.flatnonzero(entry)
+    _,keep=np.unique(ray[first].astype(np.int64)*len(counts)+cell[first],return_index=True)
+    first=first[keep]
+    ecell,iray=cell[first],ray[first]
+    counts+=np.bincount(ecell,minlength=len(counts))
+
+    # Local azimuth of the direction of travel at the entry points
+    ct,st=np.cos(t0[first]),np.sin(t0[first])
+    ex=ct*a[0][iray]+st*u[0][iray]
+    ey=ct*a[1][iray]+st*u[1][iray]
+    ez=ct*a[2][iray]+st*u[2][iray]
+    tx=ct*u[0][iray]-st*a[0][iray]
+    ty=ct*u[1][iray]-st*a[1][iray]
+    tz=ct*u[2][iray]-st*a[2][iray]
+    # East and north unit vectors at the point, scaled by cos(lat)
+    east=-ey*tx+ex*ty
+    north=-ez*(ex*tx+ey*ty)+(ex*ex+ey*ey)*tz
+    az=np.mod(np.degrees(np.arctan2(east,north)),180.)
+    # Rounding can leave e.g. a meridional path at -1e-15 degrees, which
+    # folds to just under 180, snap it to 0 so both directions agree
+    az[az>180.-1e-6]=0.
+    azbin=np.minimum((az*naz/180.).astype(int),naz-1)
+    azimuth+=np.bincount(ecell*naz+azbin,minlength=len(azimuth))
+    return
+
+
+@instrumentation.timed()
+def periods_coverage(periods_dict,lon_edges,lat_edges,periods=None,naz=18):
+    """ Ray coverage for each period of a periods dictionary
+
+    :param periods_dict: dictionary of travel times sorted by period
+                         from sort_by_period(), entries are
+                         travel-time,distance,lat1,lon1,el1,lat2,lon2,el2
+    :type periods_dict: dictionary
+    :type lon_edges,lat_edges: :class:`~numpy.ndarray`
+    :param lon_edges,lat_edges: Increasing cell edges of the grid in degrees
+    :type periods: list or array of floats
+    :param periods: Periods to compute, defaults to all in periods_dict
+    :type naz: int
+    :param naz: Number of azimuth bins between 0 and 180 degrees
+    :rtype: dictionary
+    :return: {period: coverage dictionary as returned by ray_coverage()}
+    """
+    if periods is None :
+        periods=sorted(periods_dict.keys())
+    coverage={}
+    for per in periods :
+        rays=np.array(periods_dict[per],dtype=float).reshape(-1,8)
+        coverage[per]=ray_coverage(rays[:,2],rays[:,3],rays[:,5],rays[:,6],
+                                   lon_edges,lat_edges,naz=naz)
+    return coverage
+
+
+@instrumentation.timed()
+def pair_coverage(df,lon_edges,lat_edges,naz=18):
+    """ Ray coverage of all station pairs in a measurement dataframe
+
+    :param df: Dataframe of measurement run with columns
+               lat_1,lon_1,lat_2,lon_2
+    :type df: pandas.core.frame.DataFrame
+    :type lon_edges,lat_edges: :class:`~numpy.ndarray`
+    :param lon_edges,lat_edges: Increasing cell edges of the grid in degrees
+    :rtype: dictionary
+    :return: coverage dictionary as returned by ray_coverage()
+    """
+    return ray_coverage(df['lat_1'].values,df['lon_1'].values,
+                        df['lat_2'].values,df['lon_2'].values,
+                        lon_edges,lat_edges,naz=naz)
@@ -3,9 +3,10 @@ Module containing functions for manipulating dispersion datasets
 """
 import numpy as np
 from greentools.core import create_path
+from greentools import instrumentation
 import os
-import matplotlib.pyplot as plt
 
+@instrumentation.timed()
 def qc_disp_curves(disp_dict,df,instrument_min_freq_func,no_lambda=2,min_travel_time=0):
     """ Quality control of dispersion dictionary of dispersion curves
 
@@ -43,7 +44,8 @@ def qc_disp_curves(disp_dict,df,instrument_min_freq_func,no_lambda=2,min_travel_
     except:
         raise Exception("Requires a loaded function named instrument_min_freq")
 
-    for count in disp_dict.keys():
+    instrumentation.add(curves=len(disp_dict))
+    for count in list(disp_dict.keys()):
 
         ddict=disp_dict[count]
         nstr=ddict['name']
@@ -81,6 +83,7 @@ def qc_disp_curves(disp_dict,df,instrument_min_freq_func,no_lambda=2,min_travel_
 
         # Apply limit mask to all disp curve fields
         removemask=mask1+mask2+mask3
+        instrumentation.add(picks=len(removemask))
         if removemask.any() :
             for ke in ddict.keys():
                 if ke=='name' :
@@ -95,6 +98,7 @@ def qc_disp_curves(disp_dict,df,instrument_min_freq_func,no_lambda=2,min_travel_
     return disp_dict
 
 
+@instrumentation.timed()
 def sort_by_period(disp_dict,df):
     """ Takes dispersion dictionary and produces a dictionary
     of all the observations interpolated onto desired periods
@@ -121,8 +125,9 @@ def sort_by_period(disp_dict,df):
 
     # Loop through dispersion curves and interpolate onto desired periods
     wanted_periods=np.hstack([np.arange(1,10,0.5),np.arange(10,31,1)])[::-1]
-    print "Interpolating onto periods: \n %s" % wanted_periods
-    for k in disp_dict.keys():
+    print("Interpolating onto periods: \n %s" % wanted_periods)
+    instrumentation.add(curves=len(disp_dict))
+    for k in list(disp_dict.keys()):
         # Set the full range of periods to try and find
         interp_periods=wanted_periods.copy()
         interp_freqs=1./interp_periods
@@ -151,14 +156,16 @@ def sort_by_period(disp_dict,df):
         # Checks if the freq-array is always increasing (not always with inst freq).
         # Print figures for inspection on disp curves that are not.
         if np.any(f!=sorted(f)) :
-            plt.plot(f,t,'-b',label='raw picks')
-            plt.plot(interp_freqs,interp_times,'r.',label='interpolated')
-            plt.xlabel('freq (Hz)')
-            plt.ylabel('time (s)')
-            create_path('ALERT_FIGS')
-            plt.title(disp_dict[k]['name'])
-            plt.savefig('ALERT_FIGS/'+disp_dict[k]['name']+'.png')
-            plt.close()
+            with instrumentation.stage("alert_plot",files=1) :
+                import matplotlib.pyplot as plt
+                plt.plot(f,t,'-b',label='raw picks')
+                plt.plot(interp_freqs,interp_times,'r.',label='interpolated')
+                plt.xlabel('freq (Hz)')
+                plt.ylabel('time (s)')
+                create_path('ALERT_FIGS')
+                plt.title(disp_dict[k]['name'])
+                plt.savefig('ALERT_FIGS/'+disp_dict[k]['name']+'.png')
+                plt.close()
 
         # Add information to dispersion dictionary
         disp_dict[k]['interp_freqs']=interp_freqs
@@ -177,25 +184,27 @@ def sort_by_period(disp_dict,df):
 
     # Sort into dictionary of observations at desired period
     periods_dict={}
-    for per in wanted_periods :
-        periods_dict[per]=[]
-        for k in disp_dict.keys():
-            df_row=df[df['name']==disp_dict[k]['name']]
-            # Get the vel for that period from each disp curve
-            time=disp_dict[k]['interp_times'][disp_dict[k]['interp_periods']==per]
-            if len(time)==1 :
-                periods_dict[per].append(list(time)+list(df_row[['dist','lat_1','lon_1','el_1','lat_2','lon_2','el_2']].values[0]))
+    with instrumentation.stage("sort_periods",curves=len(disp_dict)) :
+        for per in wanted_periods :
+            periods_dict[per]=[]
+            for k in disp_dict.keys():
+                df_row=df[df['name']==disp_dict[k]['name']]
+                # Get the vel for that period from each disp curve
+                time=disp_dict[k]['interp_times'][disp_dict[k]['interp_periods']==per]
+                if len(time)==1 :
+                    periods_dict[per].append(list(time)+list(df_row[['dist','lat_1','lon_1','el_1','lat_2','lon_2','el_2']].values[0]))
 
     # Look at the min max vels for each periods
     for per in sorted(periods_dict.keys()) :
         if len(periods_dict[per])<1 :
             continue
         vels=np.array(periods_dict[per])[:,1]/np.array(periods_dict[per])[:,0]
-        print "Period: %f s, min %f max %f stddev %f" % (per,np.min(vels),np.max(vels),np.std(vels))
+        print("Period: %f s, min %f max %f stddev %f" % (per,np.min(vels),np.max(vels),np.std(vels)))
 
     return periods_dict
 
 
+@instrumentation.timed()
 def ivan_tomo_input(periods_dict,outdir,output_periods,df):
     """ 
     Write out files for Ivan Koulakov's linear inversion code from the
@@ -213,15 +222,16 @@ def ivan_tomo_input(periods_dict,outdir,output_periods,df):
     # Ray files
     raydir=os.path.join(outdir,'rays')
     create_path(raydir)
-    p_fid=open(os.path.join(outdir,'periods.dat'),'wa')
-    n=01
+    p_fid=open(os.path.join(outdir,'periods.dat'),'w')
+    n=1
     for per in sorted(output_periods) :
-        print "Period %f no of measurements  %i " % (per,len(periods_dict[per]))
+        print("Period %f no of measurements  %i " % (per,len(periods_dict[per])))
         if len(periods_dict[per])<1 :
             continue
-        fid=open(os.path.join(raydir,"rays"+str("%02.f" % n)+'.dat'),'wa')
+        fid=open(os.path.join(raydir,"rays"+str("%02.f" % n)+'.dat'),'w')
+        instrumentation.add(files=1,picks=len(periods_dict[per]))
         for l in periods_dict[per] :
-            outline=" ".join(np.array([l[2],l[1],l[3],l[5],l[4],l[6],l[0]],dtype=np.str))+"\n"
+            outline=" ".join(np.array([l[2],l[1],l[3],l[5],l[4],l[6],l[0]],dtype=str))+"\n"
             out=[l[2],l[1],l[3],l[5],l[4],l[6],l[0]]
             outline="%8.4f %8.4f %6.1f %8.4f %8.4f %6.1f %8f\n" % tuple(out)
             fid.write(outline)
@@ -235,14 +245,15 @@ def ivan_tomo_input(periods_dict,outdir,output_periods,df):
         stadict[l[0].split("-")[0]]=l[1:]
     for l in df[['station','lat_2','lon_2','el_2']].values :
         stadict[l[0].split("-")[1]]=l[1:]
-    sta_fid=open(os.path.join(outdir,"stations.dat"),'wa')
-    arr=np.array(stadict.values())
+    sta_fid=open(os.path.join(outdir,"stations.dat"),'w')
+    arr=np.array(list(stadict.values()))
     for ol in arr[:,(1,0,2)]:
         sta_fid.write("%8.4f %8.4f %6.1f" % tuple(ol)+"\n")
     sta_fid.close()
     return
 
 
+@instrumentation.timed()
 def tilmann_tomo_input(disp_dict,periods,outdir,df):
     """
     Write files for Frederik's  mcmc matlab code from disp dictionary
@@ -276,8 +287,9 @@ def tilmann_tomo_input(disp_dict,periods,outdir,df):
     """
     print("Writing text files to %s" % outdir)
     create_path(outdir)
+    instrumentation.add(curves=len(disp_dict))
     # clean disp_dict of entrys with no interp_i_periods
-    for i in disp_dict.keys() :
+    for i in list(disp_dict.keys()) :
         if len(disp_dict[i]['interp_periods']) == 0 :
             del disp_dict[i]
 
@@ -290,7 +302,7 @@ def tilmann_tomo_input(disp_dict,periods,outdir,df):
     stalist=sorted(stadict.keys())
 
     # Print a station file:
-    ofid=open(os.path.join(outdir,"stations.lonlat"),'wa')
+    ofid=open(os.path.join(outdir,"stations.lonlat"),'w')
     for s in stalist :
         lat,lon,el=stadict[s]
         ofid.write("%s %s %s %s\n" % (s,lon,lat,el))
@@ -311,7 +323,7 @@ def tilmann_tomo_input(disp_dict,periods,outdir,df):
         for j,p in enumerate(periods) :
             time=disp_times[disp_pers==p]
             if len(time)>0 :
-                data_array[k,j]=time
+                data_array[k,j]=time[0]
             else :
                 data_array[k,j]=np.nan
 
@@ -2,7 +2,9 @@
 Module containing functions used around dispersion measurements with xdc
 """
 import numpy as np
+from greentools import instrumentation
 
+@instrumentation.timed()
 def read_xdc_inst_pickfile(fname):
     '''
     Reads the textfile format recording dispersion picks from 
@@ -14,4 +16,5 @@ def read_xdc_inst_pickfile(fname):
     '''
     pick_centre_freq, pick_inst_freq, pick_time, pick_dist, _, _ = np.loadtxt(fname).T
     pick_time[pick_time<0.0]=np.nan
+    instrumentation.add_file(fname,picks=len(pick_time))
     return np.column_stack([pick_centre_freq,pick_inst_freq,pick_time,pick_dist])
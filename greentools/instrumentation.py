@@ -0,0 +1,520 @@
+"""
+Module containing opt-in instrumentation of processing stages.
+
+Stages are recorded with the stage() context manager or the timed()
+decorator. For every stage the number of calls, wall time, cpu time and
+any item counts added with add() (files, traces, curves, picks,
+bytes_read, bytes_written ...) are accumulated. Memory is recorded per
+stage as rss_increase_kb, how far the stage raised the peak resident
+size of the process, and, if tracemalloc is tracing, alloc_peak_kb, the
+peak of python allocations during the stage above the level at entry.
+Both keep the largest value over all calls.
+Nested stages are recorded under their full path, e.g.
+"sort_by_period;sort_periods", which maps directly onto the collapsed
+stack format used by flamegraph tools. Each thread has its own stack of
+open stages, so stages of different threads are never nested.
+
+Instrumentation is off by default and every hook returns immediately
+when it is disabled. Enable it with enable(), or by setting the
+environment variable GREENTOOLS_PROFILE=1 before import. If
+GREENTOOLS_PROFILE_DIR is also set (or enable(outdir) is used) each
+process writes its records to profile-<pid>.json in that directory at
+exit, so the records of many worker processes can be combined
+afterwards with merge_files(). enable() exports both variables, so this
+covers multiprocessing workers started by fork, spawn or forkserver
+that exit normally, e.g. after Pool.close() and Pool.join(), provided
+the worker imports greentools. Workers stopped
+by Pool.terminate(), which includes leaving a "with Pool()" block, are
+killed without running any exit handlers; call flush() at the end of
+the task function there, or return snapshot() with the results and
+merge() them in the parent.
+
+The import time of each module is checked against IMPORT_BUDGETS with
+check_import_budgets(), which also fails any module that imports one
+of LAZY_DEPENDENCIES at module level.
+
+Example ::
+
+    from greentools import instrumentation as gti
+    gti.enable()
+    with gti.stage("read") :
+        st=read(fname)
+        gti.add_file(fname,traces=len(st))
+    gti.write_json("profile.json")
+    gti.write_flamegraph("profile.folded")
+"""
+import os
+import time
+import functools
+import threading
+
+try :
+    _wall_clock=time.perf_counter
+except AttributeError :
+    _wall_clock=time.time
+
+# Fields that are combined by taking the maximum rather than the sum
+_MAX_FIELDS=('rss_increase_kb','alloc_peak_kb')
+
+# Import time budget in seconds of each module in a fresh interpreter,
+# including greentools parent packages and any dependency imported at
+# module level. Measured with python 3.11 and numpy 2: ~2 ms for the
+# modules without numpy and ~0.1 s for those importing it. The budgets
+# leave headroom for slow shared filesystems on cluster nodes.
+IMPORT_BUDGETS={
+    'greentools':0.05,
+    'greentools.instrumentation':0.05,
+    'greentools.core':0.05,
+    'greentools.response_removal':0.05,
+    'greentools.plotting':0.05,
+    'greentools.dispersion':0.05,
+    'greentools.dispersion.aftan':0.5,
+    'greentools.dispersion.coverage':0.5,
+    'greentools.dispersion.misc':0.5,
+    'greentools.dispersion.xdc':0.5,
+}
+
+# Heavy dependencies that must only be imported on first use
+LAZY_DEPENDENCIES=('matplotlib','obspy','pandas','scipy')
+
+
+class _State(object):
+    enabled=False
+    records={}
+    lock=threading.Lock()
+    local=threading.local()
+    pid=os.getpid()
+    outdir=None
+
+    @property
+    def stack(self):
+        """ Stack of the open stages of the current thread """
+        try :
+            return self.local.stack
+        except AttributeError :
+            self.local.stack=[]
+            return self.local.stack
+
+_state=_State()
+
+
+class _NullStage(object):
+    """ Shared no-op stage returned while instrumentation is disabled """
+    def __enter__(self):
+        return self
+    def __exit__(self,*exc):
+        return False
+    def add(self,**counts):
+        return
+
+_NULL_STAGE=_NullStage()
+
+
+def _cpu_time():
+    t=os.times()
+    return t[0]+t[1]
+
+def _peak_rss_kb():
+    """ Peak resident set size of this process in kB, None if unknown """
+    try :
+        import resource
+    except ImportError :
+        return None
+    peak=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and kB elsewhere
+    if os.uname()[0]=='Darwin' :
+        peak=peak/1024.
+    return float(peak)
+
+def _tracemalloc():
+    """ The tracemalloc module if it is tracing, else None """
+    try :
+        import tracemalloc
+    except ImportError :
+        return None
+    if not tracemalloc.is_tracing() :
+        return None
+    return tracemalloc
+
+
+def _check_pid():
+    if _state.pid!=os.getpid() :
+        # Forked worker, drop the records inherited from the parent
+        _state.pid=os.getpid()
+        reset()
+    return
+
+
+class _Stage(object):
+    """ Active stage, created by stage() while instrumentation is enabled """
+    def __init__(self,name,counts):
+        _check_pid()
+        self.name=name
+        self.counts=dict(counts)
+
+    def add(self,**counts):
+        for key,val in counts.items() :
+            self.counts[key]=self.counts.get(key,0)+val
+
+    def __enter__(self):
+        stack=_state.stack
+        parent=stack[-1] if stack else None
+        self.path=";".join([s.name for s in stack]+[self.name])
+        self._rss0=_peak_rss_kb()
+        # Set even if not tracing, tracemalloc may be started inside the stage
+        self._child_peak=0
+        self._tm=_tracemalloc()
+        if self._tm is not None :
+            self._alloc0,peak0=self._tm.get_traced_memory()
+            if hasattr(self._tm,'reset_peak') :
+                # Hand the peak so far to the parent before resetting it
+                if parent is not None :
+                    parent._child_peak=max(parent._child_peak,peak0)
+                self._tm.reset_peak()
+            else :
+                self._peak0=peak0
+        # Only pushed once set up, a failure above leaves the stack intact
+        stack.append(self)
+        self._wall0=_wall_clock()
+        self._cpu0=_cpu_time()
+        return self
+
+    def __exit__(self,*exc):
+        wall=_wall_clock()-self._wall0
+        cpu=_cpu_time()-self._cpu0
+        stack=_state.stack
+        if stack and stack[-1] is self :
+            stack.pop()
+        elif self in stack :
+            stack.remove(self)
+        # ru_maxrss only ever grows, so record how far the stage raised it
+        rss=_peak_rss_kb()
+        if rss is not None :
+            rss=rss-self._rss0
+        alloc=None
+        if self._tm is not None :
+            peak=self._tm.get_traced_memory()[1]
+            if hasattr(self._tm,'reset_peak') :
+                peak=max(peak,self._child_peak)
+                if stack :
+                    stack[-1]._child_peak=max(stack[-1]._child_peak,peak)
+                alloc=peak-self._alloc0
+            else :
+                # Without reset_peak only a new process peak is visible
+                alloc=max(peak-self._peak0,0)
+        with _state.lock :
+            rec=_state.records.setdefault(self.path,{'calls':0,'wall':0.,'cpu':0.})
+            rec['calls']+=1
+            rec['wall']+=wall
+            rec['cpu']+=cpu
+            for key,val in self.counts.items() :
+                rec[key]=rec.get(key,0)+val
+            if rss is not None :
+                rec['rss_increase_kb']=max(rec.get('rss_increase_kb',0.),rss)
+            if alloc is not None :
+                rec['alloc_peak_kb']=max(rec.get('alloc_peak_kb',0.),alloc/1024.)
+        return False
+
+
+def enable(outdir=None):
+    """ Switch instrumentation on for this process
+
+    The setting is also exported through GREENTOOLS_PROFILE and
+    GREENTOOLS_PROFILE_DIR, so that child interpreters started with the
+    spawn or forkserver methods enable themselves when they import
+    greentools. Forked children inherit the state directly.
+
+    :type outdir: string
+    :param outdir: If given, records are written to
+                   outdir/profile-<pid>.json when the process, or any
+                   multiprocessing worker started from it, exits
+    """
+    _state.enabled=True
+    os.environ['GREENTOOLS_PROFILE']='1'
+    if outdir is not None :
+        outdir=os.path.abspath(outdir)
+        os.environ['GREENTOOLS_PROFILE_DIR']=outdir
+        if _state.outdir is None :
+            import atexit
+            from multiprocessing import util
+            atexit.register(_write_at_exit)
+            # Workers leave through os._exit and skip atexit, but run the
+            # multiprocessing finalizers, which are cleared after a fork
+            _register_finalizer(_state)
+            util.register_after_fork(_state,_register_finalizer)
+        _state.outdir=outdir
+    return
+
+def disable():
+    """ Switch instrumentation off, recorded stages are kept """
+    _state.enabled=False
+    os.environ['GREENTOOLS_PROFILE']='0'
+    return
+
+def is_enabled():
+    return _state.enabled
+
+def reset():
+    """ Discard all recorded stages """
+    _state.records.clear()
+    del _state.stack[:]
+    return
+
+
+def stage(name,**counts):
+    """ Context manager recording a named stage
+
+    :type name: string
+    :param name: Name of the stage, nested stages are joined with ';'
+    :param counts: Initial item counts for the stage, e.g. files=1
+    :return: Stage object, its add() method adds further item counts
+    """
+    if not _state.enabled :
+        return _NULL_STAGE
+    return _Stage(name,counts)
+
+def timed(name=None):
+    """ Decorator recording every call of a function as a stage
+
+    :type name: string
+    :param name: Name of the stage, defaults to the function name
+    """
+    def decorator(func):
+        stage_name=name or func.__name__
+        @functools.wraps(func)
+        def wrapper(*args,**kwargs):
+            if not _state.enabled :
+                return func(*args,**kwargs)
+            with _Stage(stage_name,{}) :
+                return func(*args,**kwargs)
+        return wrapper
+    return decorator
+
+def add(**counts):
+    """ Add item counts to the innermost active stage
+
+    e.g. add(traces=len(st))
+    Does nothing if instrumentation is disabled or no stage is active.
+    """
+    if _state.enabled and _state.stack :
+        _state.stack[-1].add(**counts)
+    return
+
+def add_file(fname,written=False,**counts):
+    """ Add a file read or written to the innermost active stage
+
+    Counts one file plus its size as bytes_read, or bytes_written if
+    written is True. The size is only looked up while instrumentation
+    is enabled, and only if fname is a path rather than a file object.
+    """
+    if not (_state.enabled and _state.stack) :
+        return
+    counts['files']=counts.get('files',0)+1
+    try :
+        size=os.path.getsize(fname)
+    except (TypeError,OSError) :
+        size=None
+    if size is not None :
+        counts['bytes_written' if written else 'bytes_read']=size
+    _state.stack[-1].add(**counts)
+    return
+
+
+def snapshot():
+    """ Copy of the recorded stages
+
+    The returned dictionary only contains builtin types so it can be
+    pickled back from a worker process and combined with merge().
+
+    :rtype: dictionary
+    :return: {stage path: {'calls','wall','cpu',... counts}}
+    """
+    return dict((path,dict(rec)) for path,rec in _state.records.items())
+
+def merge(records,into=None):
+    """ Combine records from another process or snapshot
+
+    Times and counts are summed, peak memory fields take the maximum.
+
+    :type records: dictionary
+    :param records: Records as returned by snapshot() or read_json()
+    :type into: dictionary
+    :param into: Records to merge into, defaults to those of this process
+    :rtype: dictionary
+    :return: The merged records
+    """
+    if into is None :
+        into=_state.records
+    for path,rec in records.items() :
+        out=into.setdefault(path,{})
+        for key,val in rec.items() :
+            if key in _MAX_FIELDS :
+                out[key]=max(out.get(key,0.),val)
+            else :
+                out[key]=out.get(key,0)+val
+    return into
+
+
+def write_json(fname,records=None):
+    """ Write records (default: this process) to a json file """
+    import json
+    if records is None :
+        records=snapshot()
+    fid=open(fname,'w')
+    json.dump(records,fid,indent=1,sort_keys=True)
+    fid.close()
+    return
+
+def read_json(fname):
+    """ Read records written by write_json() """
+    import json
+    fid=open(fname)
+    records=json.load(fid)
+    fid.close()
+    return records
+
+def merge_files(fnames):
+    """ Combine the json records of several worker processes
+
+    :type fnames: list of strings or string
+    :param fnames: json filenames, or a glob pattern for them
+    :rtype: dictionary
+    :return: The merged records
+    """
+    if isinstance(fnames,str) :
+        from glob import glob
+        fnames=sorted(glob(fnames))
+    merged={}
+    for fname in fnames :
+        merge(read_json(fname),into=merged)
+    return merged
+
+def write_flamegraph(fname,records=None,field='wall'):
+    """ Write records in collapsed stack format for flamegraph.pl/speedscope
+
+    Each line is "stage;substage value" where value is the self time of
+    the stage in microseconds, i.e. excluding time spent in substages.
+
+    :type field: string
+    :param field: 'wall' or 'cpu' time
+    """
+    if records is None :
+        records=snapshot()
+    selftime=dict((path,rec.get(field,0.)) for path,rec in records.items())
+    for path,rec in records.items() :
+        parent=path.rpartition(';')[0]
+        if parent in selftime :
+            selftime[parent]-=rec.get(field,0.)
+    fid=open(fname,'w')
+    for path in sorted(selftime) :
+        fid.write("%s %i\n" % (path,max(int(round(selftime[path]*1e6)),0)))
+    fid.close()
+    return
+
+def summary(records=None):
+    """ Print a table of the recorded stages """
+    if records is None :
+        records=snapshot()
+    print("%-50s %7s %10s %10s %12s" % ('stage','calls','wall (s)','cpu (s)','+rss kB'))
+    for path in sorted(records) :
+        rec=records[path]
+        print("%-50s %7i %10.3f %10.3f %12.0f" % (path,rec.get('calls',0),rec.get('wall',0.),
+                                                 rec.get('cpu',0.),rec.get('rss_increase_kb',0.)))
+        counts=", ".join("%s=%s" % (k,rec[k]) for k in sorted(rec)
+                         if k not in ('calls','wall','cpu')+_MAX_FIELDS)
+        if counts :
+            print("    "+counts)
+    return
+
+
+def measure_import(module,python=None):
+    """ Measure the import of a module in a fresh interpreter
+
+    :type module: string
+    :param module: Dotted module name, e.g. greentools.dispersion.misc
+    :type python: string
+    :param python: Interpreter to use, defaults to the current one
+    :rtype: tuple
+    :return: (import time in seconds, list of LAZY_DEPENDENCIES that
+              were imported as a side effect)
+    """
+    import sys
+    import json
+    import subprocess
+    code=("import sys,time,json\n"
+          "clock=getattr(time,'perf_counter',time.time)\n"
+          "t0=clock()\n"
+          "import %s\n"
+          "t=clock()-t0\n"
+          "print(json.dumps([t,[m for m in %r if m in sys.modules]]))\n" % (module,LAZY_DEPENDENCIES))
+    # Raises subprocess.CalledProcessError if the import fails, its
+    # output holds the traceback
+    out=subprocess.check_output([python or sys.executable,"-c",code],stderr=subprocess.STDOUT)
+    seconds,loaded=json.loads(out.decode().strip().splitlines()[-1])
+    return seconds,loaded
+
+def check_import_budgets(budgets=None,python=None):
+    """ Check modules against their import time budget
+
+    :type budgets: dictionary
+    :param budgets: {module: seconds}, defaults to IMPORT_BUDGETS
+    :rtype: dictionary
+    :return: {module: message} for every module that fails to import, is
+             over budget or imports one of LAZY_DEPENDENCIES, empty if
+             all pass
+    """
+    if budgets is None :
+        budgets=IMPORT_BUDGETS
+    import subprocess
+    failures={}
+    for module in sorted(budgets) :
+        try :
+            seconds,loaded=measure_import(module,python=python)
+        except subprocess.CalledProcessError as e :
+            lines=e.output.decode().strip().splitlines() or ['no output']
+            failures[module]="import failed: %s" % lines[-1]
+            continue
+        if seconds>budgets[module] :
+            failures[module]="import took %.3f s, budget %.3f s" % (seconds,budgets[module])
+        elif loaded :
+            failures[module]="imports %s at module level" % ", ".join(loaded)
+    return failures
+
+
+def flush(outdir=None):
+    """ Write the records of this process to outdir/profile-<pid>.json
+
+    Meant for worker processes that may be killed without running exit
+    handlers, e.g. by Pool.terminate(). Repeated calls overwrite the
+    file with the records so far.
+
+    :type outdir: string
+    :param outdir: Output directory, defaults to the one given to enable()
+    """
+    _check_pid()
+    outdir=outdir or _state.outdir
+    if outdir is None :
+        raise ValueError("No output directory, pass outdir or use enable(outdir)")
+    if not _state.records :
+        return
+    from greentools.core import create_path
+    create_path(outdir)
+    fname=os.path.join(outdir,"profile-%i.json" % os.getpid())
+    # Write then rename, a worker killed mid-write leaves the old file
+    write_json(fname+".tmp")
+    getattr(os,'replace',os.rename)(fname+".tmp",fname)
+    return
+
+def _write_at_exit():
+    if _state.outdir is not None :
+        flush()
+    return
+
+def _register_finalizer(state):
+    from multiprocessing import util
+    util.Finalize(None,_write_at_exit,exitpriority=0)
+    return
+
+
+if os.environ.get('GREENTOOLS_PROFILE','') not in ('','0') :
+    enable(outdir=os.environ.get('GREENTOOLS_PROFILE_DIR'))
@@ -5,7 +5,7 @@
 """
 Module containing misc functions.
 """
-import numpy as np
+
 def load_multi_segment_txtfile(fname) :
     """Read a multisegmentline text file of the format used in
     gmt .xy files, and reads into numpy arrays. 
@@ -16,6 +16,7 @@ def load_multi_segment_txtfile(fname) :
     :param return: dictionary where each entry is a numpy 
                     array of shape (n,3) for each line
     """
+    import numpy as np
     contourlines=open(fname).readlines()
     separator_ind=[i for i,s in enumerate(contourlines) if "> " in s]
     dict={}
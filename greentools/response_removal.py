@@ -5,7 +5,9 @@
 """
 Module containing functions for use in instrument response removal.
 """
+from greentools import instrumentation
 
+@instrumentation.timed()
 def deconvolve_with_pz(st,response_prefilt,pz) :
     '''
     Deconvolves stream using the supplied polezero dictionary
@@ -37,6 +39,7 @@ def deconvolve_with_pz(st,response_prefilt,pz) :
     -Acausal ringing for sharp onsets (ringing is at frequencies near Nyquist)
 
     '''
+    instrumentation.add(traces=len(st))
     for tr in st :
         tr.detrend('demean')
         tr.detrend('linear')
@@ -46,6 +49,7 @@ def deconvolve_with_pz(st,response_prefilt,pz) :
     return st
 
 
+@instrumentation.timed()
 def get_pazdictfrominventory(inventory,tr):
     ''' Reads an obspy station inventory object and
     for a given trace returns the obspy paz dictionary   
@@ -70,6 +74,7 @@ def get_pazdictfrominventory(inventory,tr):
     return pzdict
 
 
+@instrumentation.timed()
 def read_sacpzfile(file):
     ''' Reads a sac format poles-zero file
     Expects ZEROS, POLES and CONSTANT as keywords
@@ -122,4 +127,5 @@ def read_sacpzfile(file):
                 P=False
                 instpaz['poles']=poles
     fid.close()
+    instrumentation.add_file(file)
     return instpaz
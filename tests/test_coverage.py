@@ -0,0 +1,142 @@
+"""
+Known answer checks of greentools.dispersion.coverage
+"""
+import time
+
+import numpy as np
+
+from greentools.dispersion import coverage
+
+LON=np.arange(0.,10.01,0.5)
+LAT=np.arange(40.,50.01,0.5)
+
+
+def test_meridional_path_length():
+    cov=coverage.ray_coverage([41.],[5.25],[44.],[5.25],LON,LAT)
+    expected=np.radians(3.)*coverage.EARTH_RADIUS_KM
+    assert np.isclose(cov['length'].sum(),expected)
+    # Passes through the cells between 41 and 44 N in one column
+    assert cov['counts'].sum()==6
+    assert np.all(cov['counts'][2:8,10]==1)
+
+def test_dateline_crossing_on_0_360_grid():
+    lon=np.arange(170.,190.01,1.)
+    lat=np.arange(-5.,5.01,1.)
+    cov=coverage.ray_coverage([0.5],[179.],[0.5],[-179.],lon,lat)
+    assert cov['counts'].sum()==2
+    assert cov['counts'][5,9]==1 and cov['counts'][5,10]==1
+    assert np.isclose(cov['length'].sum(),np.radians(2.)*coverage.EARTH_RADIUS_KM,rtol=1e-4)
+
+def test_azimuth_bins_are_undirected():
+    lon=np.arange(0.,10.01,1.)
+    lat=np.arange(-5.,5.01,1.)
+    # North-south paths in bin 0, east-west along the equator in bin 9
+    for lat1,lon1,lat2,lon2,azbin in [(-4.,5.5,4.,5.5,0),(4.,5.5,-4.,5.5,0),
+                                      (0.,1.,0.,9.,9),(0.,9.,0.,1.,9)] :
+        cov=coverage.ray_coverage([lat1],[lon1],[lat2],[lon2],lon,lat,naz=18)
+        hist=cov['azimuth'].sum(axis=(0,1))
+        assert hist[azbin]==cov['counts'].sum()
+    assert np.allclose(cov['azimuth_edges'],np.arange(0.,180.1,10.))
+
+def test_zero_length_ray_is_left_out():
+    cov=coverage.ray_coverage([41.,41.],[5.25,5.25],[41.,44.],[5.25,5.25],LON,LAT)
+    assert cov['counts'].sum()==6
+    assert cov['azimuth'].sum()==6
+
+def test_high_latitude_cells_are_not_skipped():
+    lon=np.arange(0.,10.01,1.)
+    lat=np.arange(70.,80.01,1.)
+    cov=coverage.ray_coverage([79.5],[0.5],[79.5],[9.5],lon,lat)
+    assert np.all(cov['counts'].sum(axis=0)==1)
+
+def _sampled_length(lat1,lon1,lat2,lon2,lon,lat,step=1e-5):
+    """ Path length per cell from points every step radians along the ray """
+    a=coverage._unit_vectors(lat1,lon1)
+    b=coverage._unit_vectors(lat2,lon2)
+    omega=np.arccos(np.clip(np.dot(a,b),-1.,1.))
+    u=(b-np.cos(omega)*a)/np.sqrt(np.sum((b-np.cos(omega)*a)**2))
+    n=int(np.ceil(omega/step))
+    theta=(np.arange(n)+0.5)*omega/n
+    p=np.cos(theta)[:,None]*a+np.sin(theta)[:,None]*u
+    plon=np.degrees(np.arctan2(p[:,1],p[:,0]))
+    plon[plon<lon[0]]+=360.
+    ilon=np.searchsorted(lon,plon,side='right')-1
+    ilat=np.searchsorted(lat,np.degrees(np.arcsin(p[:,2])),side='right')-1
+    inside=(ilon>=0)&(ilon<len(lon)-1)&(ilat>=0)&(ilat<len(lat)-1)
+    cell=ilat[inside]*(len(lon)-1)+ilon[inside]
+    length=np.bincount(cell,minlength=(len(lon)-1)*(len(lat)-1))*omega/n
+    return length.reshape(len(lat)-1,len(lon)-1)*coverage.EARTH_RADIUS_KM
+
+def test_matches_fine_sampling():
+    # Regional, pole-reaching global and dateline grids
+    rng=np.random.RandomState(1)
+    for lon,lat,box in [(LON,LAT,(38.,52.,-2.,12.)),
+                        (np.arange(-180.,180.01,10.),np.arange(-90.,90.01,10.),(-90.,90.,-180.,180.)),
+                        (np.arange(160.,200.01,1.),np.arange(-10.,10.01,1.),(-12.,12.,155.,205.))] :
+        for i in range(40) :
+            lat1,lat2=rng.uniform(box[0],box[1],2)
+            lon1,lon2=rng.uniform(box[2],box[3],2)
+            cov=coverage.ray_coverage([lat1],[lon1],[lat2],[lon2],lon,lat)
+            ref=_sampled_length(lat1,lon1,lat2,lon2,lon,lat)
+            # Equal up to the sampling step of 0.064 km
+            assert np.allclose(cov['length'],ref,atol=0.13)
+            assert np.all(cov['counts'][ref>0]==1)
+            assert np.all(cov['length'][(cov['counts']>0)&(ref==0)]<0.13)
+            assert cov['counts'].max()<=1
+
+def test_short_corner_crossing_is_counted():
+    # Clips the corner of cell (1,0) for about 50 m
+    lon=np.arange(0.,3.01,1.)
+    lat=np.arange(0.,3.01,1.)
+    cov=coverage.ray_coverage([0.2],[0.2],[1.8],[1.8],lon,lat)
+    assert cov['counts'].sum()==3 and cov['counts'][1,0]==1
+    assert 0.<cov['length'][1,0]<0.1
+    omega=np.arccos(np.dot(coverage._unit_vectors(0.2,0.2),coverage._unit_vectors(1.8,1.8)))
+    assert np.isclose(cov['length'].sum(),omega*coverage.EARTH_RADIUS_KM)
+
+def test_path_over_the_pole():
+    lon=np.arange(-180.,180.01,1.)
+    lat=np.arange(60.,90.01,1.)
+    cov=coverage.ray_coverage([80.],[10.5],[80.],[-169.5],lon,lat)
+    assert cov['counts'].sum()==20
+    assert np.all(cov['counts'][20:,190]==1) and np.all(cov['counts'][20:,10]==1)
+    assert np.isclose(cov['length'].sum(),np.radians(20.)*coverage.EARTH_RADIUS_KM)
+
+def test_periods_coverage_with_empty_period():
+    # travel-time,distance,lat1,lon1,el1,lat2,lon2,el2
+    periods_dict={5.0:[],10.0:[[100.,300.,41.,5.25,0.,44.,5.25,0.]]}
+    cov=coverage.periods_coverage(periods_dict,LON,LAT)
+    assert sorted(cov)==[5.0,10.0]
+    assert cov[5.0]['counts'].shape==(20,20)
+    assert cov[5.0]['counts'].sum()==0 and cov[5.0]['length'].sum()==0
+    assert cov[10.0]['counts'].sum()==6
+
+def test_million_rays_on_one_degree_grid():
+    rng=np.random.RandomState(0)
+    n=1000000
+    lat1,lat2=rng.uniform(40.,50.,(2,n))
+    lon1,lon2=rng.uniform(0.,10.,(2,n))
+    lon=np.arange(0.,10.01,1.)
+    lat=np.arange(40.,50.01,1.)
+    t0=time.time()
+    cov=coverage.ray_coverage(lat1,lon1,lat2,lon2,lon,lat)
+    assert time.time()-t0<15.
+    assert cov['azimuth'].sum()==cov['counts'].sum()
+
+def test_regional_rays_on_global_grid():
+    # The cost follows the cells crossed, not the extent of the grid
+    rng=np.random.RandomState(0)
+    n=1000000
+    lat1,lat2=rng.uniform(40.,50.,(2,n))
+    lon1,lon2=rng.uniform(0.,10.,(2,n))
+    lon=np.arange(-180.,180.01,1.)
+    lat=np.arange(-90.,90.01,1.)
+    t0=time.time()
+    cov=coverage.ray_coverage(lat1,lon1,lat2,lon2,lon,lat)
+    assert time.time()-t0<15.
+    n=10000
+    # Same counts as on the regional grid over the same cells
+    cov=coverage.ray_coverage(lat1[:n],lon1[:n],lat2[:n],lon2[:n],lon,lat)
+    regional=coverage.ray_coverage(lat1[:n],lon1[:n],lat2[:n],lon2[:n],
+                                   np.arange(0.,10.01,1.),np.arange(40.,50.01,1.))
+    assert np.array_equal(cov['counts'][130:140,180:190],regional['counts'])
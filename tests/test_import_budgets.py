@@ -0,0 +1,27 @@
+"""
+Import time budgets of the greentools modules
+"""
+import sys
+import subprocess
+
+from greentools import instrumentation
+
+
+def test_import_budgets():
+    assert instrumentation.check_import_budgets()=={}
+
+def test_misc_does_not_import_matplotlib():
+    code=("import sys\n"
+          "import greentools.dispersion.misc\n"
+          "print('matplotlib' in sys.modules)\n")
+    out=subprocess.check_output([sys.executable,"-c",code])
+    assert out.decode().strip()=="False"
+
+def test_submodules_load_on_first_access():
+    code=("import sys,greentools\n"
+          "assert 'greentools.core' not in sys.modules\n"
+          "greentools.core.create_path\n"
+          "greentools.dispersion.xdc.read_xdc_inst_pickfile\n"
+          "print('ok')\n")
+    out=subprocess.check_output([sys.executable,"-c",code])
+    assert out.decode().strip()=="ok"
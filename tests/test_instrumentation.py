@@ -0,0 +1,159 @@
+"""
+Stage recording, merging and export of greentools.instrumentation
+"""
+import io
+import os
+import glob
+import threading
+import tracemalloc
+import multiprocessing
+
+from greentools import instrumentation
+
+
+_ENV=('GREENTOOLS_PROFILE','GREENTOOLS_PROFILE_DIR')
+
+def setup_function(function):
+    function.environ=dict((k,os.environ.get(k)) for k in _ENV)
+    instrumentation.reset()
+    instrumentation.enable()
+
+def teardown_function(function):
+    instrumentation.disable()
+    instrumentation.reset()
+    # Stop the exit handlers writing into a removed test directory
+    instrumentation._state.outdir=None
+    for key,val in function.environ.items() :
+        if val is None :
+            os.environ.pop(key,None)
+        else :
+            os.environ[key]=val
+
+
+@instrumentation.timed()
+def _timed_work():
+    with instrumentation.stage("inner",curves=2) :
+        instrumentation.add(picks=3)
+
+def _work(i):
+    with instrumentation.stage("work",items=1) :
+        sum(range(1000))
+    return i
+
+
+def test_nested_stage_paths():
+    _timed_work()
+    _timed_work()
+    records=instrumentation.snapshot()
+    assert sorted(records)==['_timed_work','_timed_work;inner']
+    assert records['_timed_work']['calls']==2
+    assert records['_timed_work;inner']['curves']==4
+    assert records['_timed_work;inner']['picks']==6
+
+def test_disabled_is_a_no_op():
+    instrumentation.disable()
+    with instrumentation.stage("off") as st :
+        st.add(files=1)
+        instrumentation.add(files=1)
+    _timed_work()
+    assert instrumentation.snapshot()=={}
+
+def test_merge_sums_counts_and_keeps_peak():
+    a={'s':{'calls':1,'wall':1.,'files':2,'rss_increase_kb':10.}}
+    b={'s':{'calls':2,'wall':.5,'files':1,'rss_increase_kb':30.},'t':{'calls':1}}
+    merged=instrumentation.merge(b,into=instrumentation.merge(a,into={}))
+    assert merged['s']=={'calls':3,'wall':1.5,'files':3,'rss_increase_kb':30.}
+    assert merged['t']=={'calls':1}
+
+def test_flamegraph_self_time(tmp_path):
+    records={'a':{'wall':3.},'a;b':{'wall':1.},'a;c':{'wall':.5}}
+    fname=str(tmp_path/"profile.folded")
+    instrumentation.write_flamegraph(fname,records=records)
+    lines=open(fname).read().splitlines()
+    assert lines==['a 1500000','a;b 1000000','a;c 500000']
+
+def test_add_file_with_path_and_file_object(tmp_path):
+    fname=str(tmp_path/"data.txt")
+    open(fname,'w').write("12345")
+    with instrumentation.stage("read") :
+        instrumentation.add_file(fname)
+        instrumentation.add_file(io.StringIO(u"12345"))
+    rec=instrumentation.snapshot()['read']
+    assert rec['files']==2
+    assert rec['bytes_read']==5
+
+def test_memory_is_recorded_per_stage():
+    tracemalloc.start()
+    try :
+        with instrumentation.stage("big") :
+            data=bytearray(20*1024*1024)
+            del data
+        with instrumentation.stage("tiny") :
+            pass
+    finally :
+        tracemalloc.stop()
+    records=instrumentation.snapshot()
+    assert records['big']['alloc_peak_kb']>=20*1024
+    assert records['tiny']['alloc_peak_kb']<1024
+    assert records['tiny']['rss_increase_kb']<records['big']['rss_increase_kb']+1
+
+def test_tracemalloc_started_inside_a_stage():
+    try :
+        with instrumentation.stage("outer") :
+            tracemalloc.start()
+            with instrumentation.stage("inner") :
+                data=bytearray(1024*1024)
+                del data
+        with instrumentation.stage("after") :
+            pass
+    finally :
+        tracemalloc.stop()
+    assert sorted(instrumentation.snapshot())==['after','outer','outer;inner']
+
+def test_threads_have_separate_stacks():
+    entered,done=threading.Event(),threading.Event()
+    def first():
+        with instrumentation.stage("a") :
+            entered.set()
+            done.wait(10)
+            instrumentation.add(x=1)
+    def second():
+        entered.wait(10)
+        with instrumentation.stage("b") :
+            instrumentation.add(y=1)
+        done.set()
+    threads=[threading.Thread(target=f) for f in (first,second)]
+    for t in threads :
+        t.start()
+    for t in threads :
+        t.join()
+    records=instrumentation.snapshot()
+    assert sorted(records)==['a','b']
+    assert records['a']['x']==1 and 'y' not in records['a']
+    assert records['b']['y']==1
+
+def _check_pool_workers(method,outdir):
+    instrumentation.enable(outdir)
+    pool=multiprocessing.get_context(method).Pool(2)
+    pool.map(_work,range(20))
+    pool.close()
+    pool.join()
+    fnames=glob.glob(os.path.join(outdir,"profile-*.json"))
+    assert len(fnames)==2
+    assert instrumentation.merge_files(fnames)['work']['items']==20
+
+def test_pool_workers_with_fork(tmp_path):
+    _check_pool_workers('fork',str(tmp_path))
+
+def test_pool_workers_with_spawn(tmp_path):
+    _check_pool_workers('spawn',str(tmp_path))
+
+def test_flush_replaces_the_file(tmp_path):
+    outdir=str(tmp_path)
+    _work(0)
+    instrumentation.flush(outdir)
+    _work(1)
+    instrumentation.flush(outdir)
+    fnames=os.listdir(outdir)
+    assert fnames==["profile-%i.json" % os.getpid()]
+    assert instrumentation.read_json(os.path.join(outdir,fnames[0]))['work']['calls']==2